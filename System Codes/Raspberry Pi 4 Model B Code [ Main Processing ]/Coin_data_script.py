@@ -1,15 +1,36 @@
-import serial
-import firebase_admin
-from firebase_admin import credentials, db
+import asyncio
+import collections
+import re
+import time
 
-# Initialize Firebase
+import aioserial
+import requests
+from firebase_admin import credentials
+from requests.adapters import HTTPAdapter
+
+# Firebase credentials (the service account only supplies the token;
+# counter writes go over plain REST, which is far lighter than the
+# admin SDK's per-call request machinery)
 cred = credentials.Certificate("firebaseKey.json")
-firebase_admin.initialize_app(cred, {
-    'databaseURL': 'https://hardware-project-be-default-rtdb.asia-southeast1.firebasedatabase.app/'
-})
+DATABASE_URL = 'https://hardware-project-be-default-rtdb.asia-southeast1.firebasedatabase.app'
+
+# One keep-alive HTTPS connection reused for every counter write
+SESSION = requests.Session()
+SESSION.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=1))
+
+_access_token = None
+_token_refresh_at = 0.0
+
+def auth_header():
+    """Bearer token from the service account, refreshed before it expires"""
+    global _access_token, _token_refresh_at
+    if time.time() > _token_refresh_at:
+        _access_token = cred.get_access_token().access_token
+        _token_refresh_at = time.time() + 3000  # tokens last 3600s
+    return {'Authorization': f'Bearer {_access_token}'}
 
 # Connect to Arduino (Coin/Display system)
-ser = serial.Serial('/dev/ttyACM1', 9600, timeout=1)
+ser = aioserial.AioSerial('/dev/ttyACM1', 9600, timeout=1)
 
 print("📡 Listening to Coin Arduino on /dev/ttyACM1...")
 print("🔧 New Format Support:")
@@ -17,175 +38,194 @@ print("   - Arduino should send 'COIN:1', 'COIN:2', 'COIN:5', 'COIN:10' when coi
 print("   - Legacy support for 'Rs.1', 'Rs.2', etc. still available")
 print("   - Firebase structure remains: coin_totals/Rs_1, coin_totals/Rs_2, etc.")
 
-# Function to sanitize coin name (Firebase-safe path)
-def sanitize(coin_name):
-    return coin_name.replace('.', '_')
+# One compiled matcher replaces the startswith/replace/isdigit chains
+DETECTION_PAT = re.compile(r'^(COIN:|NOTE:|Rs\.)(\d+)$')
+COIN_VALUES = frozenset((1, 2, 5, 10))
+NOTE_VALUES = frozenset((20, 50, 100, 500, 1000, 5000))
+
+# Firebase-safe counter paths, precomputed per denomination
+# (e.g. Rs.1 → coin_totals/Rs_1) so no strings are built per event
+COIN_PATHS = {value: f'coin_totals/Rs_{value}' for value in COIN_VALUES}
+NOTE_PATHS = {value: f'note_totals/Rs_{value}' for value in NOTE_VALUES}
+
+# Pending counter updates, flushed to Firebase in one batched write.
+# Only the event-loop thread touches `pending`; worker threads hand
+# failed batches back via requeue_batch below.
+pending = collections.Counter()
+last_flush = time.monotonic()
+FLUSH_INTERVAL = 0.3  # seconds to coalesce a burst of detections
+
+# Running event loop, captured by main() so worker threads can marshal
+# re-queues back onto the loop thread
+_loop = None
+
+def requeue_batch(batch):
+    """Return a failed batch to `pending` without touching it cross-thread"""
+    try:
+        _loop.call_soon_threadsafe(pending.update, batch)
+        print(f"⚠️ Re-queued {sum(batch.values())} update(s) for the next flush window")
+    except (AttributeError, RuntimeError):
+        # No loop left (shutdown flush) - nothing further can retry these
+        print(f"❌ {sum(batch.values())} update(s) could not be delivered before exit")
 
 # Function to update Firebase for coins
 def update_coin_total(coin_value):
-    coin_type = f"Rs.{coin_value}"  # Convert COIN:1 → Rs.1 for Firebase
-    safe_type = sanitize(coin_type)  # e.g., Rs.1 → Rs_1
-    ref = db.reference('coin_totals/' + safe_type)
-    current = ref.get()
-    if current is None:
-        current = 0
-    ref.set(current + 1)
-    print(f"✅ Updated COIN:{coin_value} → Firebase: {safe_type} = {current + 1}")
+    pending[COIN_PATHS[coin_value]] += 1
+    print(f"✅ Queued COIN:{coin_value} → Firebase: Rs_{coin_value} (+1)")
 
 # Function to update Firebase for notes
 def update_note_total(note_value):
-    note_type = f"Rs.{note_value}"  # Convert NOTE:100 → Rs.100 for Firebase
-    safe_type = sanitize(note_type)  # e.g., Rs.100 → Rs_100
-    ref = db.reference('note_totals/' + safe_type)
-    current = ref.get()
-    if current is None:
-        current = 0
-    ref.set(current + 1)
-    print(f"✅ Updated NOTE:{note_value} → Firebase: {safe_type} = {current + 1}")
+    pending[NOTE_PATHS[note_value]] += 1
+    print(f"✅ Queued NOTE:{note_value} → Firebase: Rs_{note_value} (+1)")
+
+# Send one batch of queued counts as a single multi-location update.
+# Retries happen here on the worker thread; only the event-loop thread
+# ever touches `pending`, so there is no snapshot/clear race.
+def push_batch(batch, attempts=3):
+    # Server-side increments, so one PATCH covers the whole burst atomically
+    updates = {path: {'.sv': {'increment': count}} for path, count in batch.items()}
+    for attempt in range(1, attempts + 1):
+        try:
+            response = SESSION.patch(f'{DATABASE_URL}/.json', json=updates,
+                                     headers=auth_header(), timeout=10)
+            response.raise_for_status()
+            print(f"📤 Flushed {sum(batch.values())} update(s) to Firebase in one write")
+            return
+        except Exception as e:
+            print(f"❌ Firebase flush failed (attempt {attempt}/{attempts}): {e}")
+            if attempt < attempts:
+                time.sleep(2)
+    # Out of attempts: hand the counts back so they ride a later window
+    # once connectivity returns, instead of being miscounted cash
+    requeue_batch(batch)
+
+# Synchronous flush of everything still queued (used at shutdown)
+def flush_pending():
+    global last_flush
+    if pending:
+        batch = dict(pending)
+        pending.clear()
+        push_batch(batch)
+    last_flush = time.monotonic()
 
 # Function to process detection data
 def process_detection(detection_string):
-    """Process detection and determine if it's coin or note based on value"""
+    """Parse a detection line and queue the coin/note update.
+
+    Returns "ok" for a handled detection, "noise" for a recognized
+    prefix with an unknown value, and "debug" for anything else so the
+    main loop can log it.
+    """
     try:
-        detection_string = detection_string.strip()
-        
+        match = DETECTION_PAT.match(detection_string)
+
+        if not match:
+            # Not a recognized format
+            return "debug"
+
+        prefix = match.group(1)
+        value = int(match.group(2))
+
         # Handle new COIN: format
-        if detection_string.startswith("COIN:"):
-            value_str = detection_string.replace("COIN:", "")
-            
-            if not value_str.isdigit():
-                print(f"⚠️ Invalid coin format: {detection_string}")
-                return
-                
-            value = int(value_str)
-            
-            # Valid coin values
-            if value in [1, 2, 5, 10]:
+        if prefix == "COIN:":
+            if value in COIN_VALUES:
                 print(f"🪙 Coin Detected: COIN:{value}")
                 update_coin_total(value)
-            else:
-                print(f"⚠️ Unknown coin value: {detection_string}")
-            return
-            
+                return "ok"
+            print(f"⚠️ Unknown coin value: {detection_string}")
+
         # Handle NOTE: format (if needed)
-        elif detection_string.startswith("NOTE:"):
-            value_str = detection_string.replace("NOTE:", "")
-            
-            if not value_str.isdigit():
-                print(f"⚠️ Invalid note format: {detection_string}")
-                return
-                
-            value = int(value_str)
-            
-            # Valid note values
-            if value in [20, 50, 100, 500, 1000, 5000]:
+        elif prefix == "NOTE:":
+            if value in NOTE_VALUES:
                 print(f"💵 Note Detected: NOTE:{value}")
                 update_note_total(value)
-            else:
-                print(f"⚠️ Unknown note value: {detection_string}")
-            return
-            
+                return "ok"
+            print(f"⚠️ Unknown note value: {detection_string}")
+
         # Legacy Rs. format support
-        elif detection_string.startswith("Rs."):
-            value_str = detection_string.replace("Rs.", "")
-            
-            if not value_str.isdigit():
-                print(f"⚠️ Invalid Rs. format: {detection_string}")
-                return
-                
-            value = int(value_str)
-            
-            if value in [1, 2, 5, 10]:
+        else:
+            if value in COIN_VALUES:
                 print(f"🪙 Legacy Coin: Rs.{value}")
                 update_coin_total(value)
-            elif value in [20, 50, 100, 500, 1000, 5000]:
+                return "ok"
+            elif value in NOTE_VALUES:
                 print(f"💵 Legacy Note: Rs.{value}")
                 update_note_total(value)
-            else:
-                print(f"⚠️ Unknown Rs. value: {detection_string}")
-            return
-        
-        # Not a recognized format
-        print(f"ℹ️ Ignoring: {detection_string}")
-        
+                return "ok"
+            print(f"⚠️ Unknown Rs. value: {detection_string}")
+
+        return "noise"
+
     except Exception as e:
         print(f"❌ Error processing: {detection_string} - {e}")
+        return "noise"
+
+# Main monitoring loop (async so serial reads and Firebase writes overlap)
+async def main():
+    global ser, last_flush, _loop
+    loop = _loop = asyncio.get_running_loop()
+
+    while True:
+        try:
+            # Read line from Arduino without blocking the event loop
+            line = (await ser.readline_async()).decode('utf-8', errors='ignore').strip()
+
+            if line:
+                # Single parse: process_detection reports what the line was
+                if process_detection(line) == "debug":
+                    # Show Arduino messages but filter noise
+                    if len(line) > 3 and not any(prefix in line for prefix in ["COIN:", "NOTE:", "Rs."]):
+                        print(f"📄 Arduino: {line}")
+                    elif len(line) == 1:
+                        # Debug single characters
+                        print(f"🔧 Debug: '{line}' (ASCII: {ord(line)})")
+                    elif 1 < len(line) <= 3:
+                        print(f"🔧 Debug: Short data '{line}'")
+
+            # Flush queued counts once the coalescing window has passed.
+            # The write runs in a worker thread (firebase-admin is sync),
+            # so the serial reader keeps running while the RPC is in flight.
+            if pending and (time.monotonic() - last_flush) > FLUSH_INTERVAL:
+                batch = dict(pending)
+                pending.clear()
+                last_flush = time.monotonic()
+                loop.run_in_executor(None, push_batch, batch)
+
+        except UnicodeDecodeError as e:
+            print(f"⚠️ Encoding error: {e}")
+            try:
+                # Try to recover
+                raw_data = await ser.readline_async()
+                line = raw_data.decode('utf-8', errors='replace').strip()
+                if line and line != '\ufffd' and process_detection(line) == "ok":
+                    print(f"🔍 Recovered: {line}")
+            except Exception as recovery_error:
+                print(f"❌ Recovery failed: {recovery_error}")
+
+        except Exception as e:
+            print(f"❌ Communication error: {e}")
+            try:
+                ser.close()
+                ser = aioserial.AioSerial('/dev/ttyACM1', 9600, timeout=1)
+                print("🔄 Reconnected to Arduino")
+            except Exception as reconnect_error:
+                print(f"❌ Reconnection failed: {reconnect_error}")
+                break
 
-def is_valid_detection(line):
-    """Check if line contains valid detection data"""
-    if not line:
-        return False
-    
-    # Check COIN: format
-    if line.startswith("COIN:"):
-        value_part = line.replace("COIN:", "").strip()
-        if value_part.isdigit():
-            return int(value_part) in [1, 2, 5, 10]
-    
-    # Check NOTE: format
-    if line.startswith("NOTE:"):
-        value_part = line.replace("NOTE:", "").strip()
-        if value_part.isdigit():
-            return int(value_part) in [20, 50, 100, 500, 1000, 5000]
-    
-    # Check Rs. format
-    if line.startswith("Rs."):
-        value_part = line.replace("Rs.", "").strip()
-        if value_part.isdigit():
-            return int(value_part) in [1, 2, 5, 10, 20, 50, 100, 500, 1000, 5000]
-    
-    return False
-
-# Main monitoring loop
 print("\n🚀 Starting coin detection monitoring...")
 print("💡 Supported formats:")
 print("   • COIN:1, COIN:2, COIN:5, COIN:10 (new)")
 print("   • Rs.1, Rs.2, Rs.5, Rs.10, Rs.20, Rs.50, Rs.100, Rs.500, Rs.1000, Rs.5000 (legacy)")
 print("🛑 Press Ctrl+C to stop\n")
 
-while True:
-    try:
-        # Read line from Arduino
-        line = ser.readline().decode('utf-8', errors='ignore').strip()
-        
-        if line:
-            if is_valid_detection(line):
-                print(f"🔍 Valid Detection: {line}")
-                process_detection(line)
-            else:
-                # Show Arduino messages but filter noise
-                if len(line) > 3 and not any(prefix in line for prefix in ["COIN:", "NOTE:", "Rs."]):
-                    print(f"📄 Arduino: {line}")
-                elif len(line) == 1:
-                    # Debug single characters
-                    print(f"🔧 Debug: '{line}' (ASCII: {ord(line)})")
-                elif 1 < len(line) <= 3:
-                    print(f"🔧 Debug: Short data '{line}'")
-                    
-    except UnicodeDecodeError as e:
-        print(f"⚠️ Encoding error: {e}")
-        try:
-            # Try to recover
-            raw_data = ser.readline()
-            line = raw_data.decode('utf-8', errors='replace').strip()
-            if line and line != '\ufffd' and is_valid_detection(line):
-                print(f"🔍 Recovered: {line}")
-                process_detection(line)
-        except Exception as recovery_error:
-            print(f"❌ Recovery failed: {recovery_error}")
-            
-    except KeyboardInterrupt:
-        print("\n🛑 Stopping coin detection monitoring...")
-        break
-        
-    except Exception as e:
-        print(f"❌ Communication error: {e}")
-        try:
-            ser.close()
-            ser = serial.Serial('/dev/ttyACM1', 9600, timeout=1)
-            print("🔄 Reconnected to Arduino")
-        except Exception as reconnect_error:
-            print(f"❌ Reconnection failed: {reconnect_error}")
-            break
+try:
+    asyncio.run(main())
+except KeyboardInterrupt:
+    print("\n🛑 Stopping coin detection monitoring...")
+finally:
+    # Every exit path drains the last coalescing window - queued counts
+    # were already acknowledged to the operator, so they must not vanish
+    # just because the loop ended on a reconnect failure instead of Ctrl+C
+    flush_pending()
 
 print("👋 Monitoring stopped")
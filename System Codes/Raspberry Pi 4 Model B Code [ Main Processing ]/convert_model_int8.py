@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+One-off converter: re-export the currency model as INT8 TFLite
+- Run on the training machine (needs full TensorFlow, not tflite_runtime)
+- Post-training quantization with a representative dataset from sorting_images/
+- Output: currency_model_int8.tflite (copy next to Main_script.py on the Pi)
+
+Usage: python3 convert_model_int8.py <saved_model_dir> [representative_image_dir]
+"""
+
+import glob
+import sys
+
+import cv2
+import numpy as np
+import tensorflow as tf
+
+saved_model_dir = sys.argv[1] if len(sys.argv) > 1 else "currency_model_saved"
+image_dir = sys.argv[2] if len(sys.argv) > 2 else "sorting_images"
+
+
+def representative_dataset():
+    """Feed ~100 real captures so the converter can calibrate ranges"""
+    paths = sorted(glob.glob(f"{image_dir}/*.jpg"))[:100]
+    if not paths:
+        print(f"⚠️ No calibration images in {image_dir}/ - using random data")
+    for path in paths or range(100):
+        if paths:
+            img = cv2.imread(path)
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+            img = cv2.resize(img, (224, 224))
+        else:
+            img = np.random.randint(0, 256, (224, 224, 3), dtype=np.uint8)
+        yield [np.expand_dims(img / 255.0, axis=0).astype(np.float32)]
+
+
+converter = tf.lite.TFLiteConverter.from_saved_model(saved_model_dir)
+converter.optimizations = [tf.lite.Optimize.DEFAULT]
+converter.representative_dataset = representative_dataset
+converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+# uint8 in/out lets the Pi feed camera pixels without a float conversion
+converter.inference_input_type = tf.uint8
+converter.inference_output_type = tf.uint8
+
+print("🔄 Converting model to INT8...")
+tflite_model = converter.convert()
+
+with open("currency_model_int8.tflite", "wb") as f:
+    f.write(tflite_model)
+
+print("✅ Wrote currency_model_int8.tflite")